@@ -3,7 +3,12 @@ import pandas as pd
 import numpy as np
 import io
 import re
-from urllib.parse import urlparse
+
+# Numba is optional; without it traffic is always computed with NumPy
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # Define the CTR curve as percentages
 ctr_curve = {
@@ -13,32 +18,75 @@ ctr_curve = {
     19: 1.76, 20: 1.3
 }
 
+# CTR curve as a lookup table indexed by position (0-100), as fractions
+CTR_TABLE = np.zeros(101, dtype=np.float64)
+CTR_TABLE[np.fromiter(ctr_curve.keys(), dtype=np.int64)] = np.fromiter(ctr_curve.values(), dtype=np.float64) / 100.0
+
+# Row count above which the Numba kernel is used (below it, JIT warmup dominates)
+NUMBA_MIN_ROWS = 200_000
+
+if njit is not None:
+    # Serial on purpose: Streamlit runs sessions on separate threads, and Numba's
+    # default parallel threading layer aborts the process on concurrent use
+    @njit(cache=True)
+    def _traffic_kernel(rank, sv, ctr_table):
+        n = rank.shape[0]
+        out = np.empty(n, dtype=np.int64)
+        for i in range(n):
+            p = rank[i]
+            if 1 <= p <= 100:
+                out[i] = np.int64(np.rint(ctr_table[p] * sv[i]))
+            else:
+                out[i] = 0
+        return out
+else:
+    _traffic_kernel = None
+
+# Function to estimate traffic for arrays of positions and search volumes
+def estimate_traffic_array(pos, sv):
+    if _traffic_kernel is not None and len(pos) > NUMBA_MIN_ROWS:
+        return _traffic_kernel(pos, sv, CTR_TABLE)
+    traffic = CTR_TABLE[pos]
+    np.multiply(traffic, sv, out=traffic)
+    np.rint(traffic, out=traffic)
+    return traffic.astype(np.int64)
+
+# Bounds for cached uploads, so old files do not stay in memory indefinitely
+CACHE_MAX_ENTRIES = 8
+CACHE_TTL_SECONDS = 3600
+
+# Precompiled patterns for domain normalization
+_RX_PROTO = re.compile(r'^https?://')
+_RX_WWW = re.compile(r'^www\.')
+_RX_HOST_END = re.compile(r'[/?#]')
+
 def normalize_domain(domain):
     if domain == 'Unknown_Domain':
         return domain
+    # Lowercase first so the protocol and 'www.' patterns match any casing
+    domain = domain.lower()
+
     # Remove protocol if present
-    domain = re.sub(r'^https?://', '', domain)
+    domain = _RX_PROTO.sub('', domain)
     
-    # Parse the domain
-    parsed = urlparse('//' + domain)
-    
-    # Get the network location (domain)
-    domain = parsed.netloc
+    # Keep only the host part, dropping any path, query or fragment
+    domain = _RX_HOST_END.split(domain, 1)[0]
     
     # Remove 'www.' if present
-    domain = re.sub(r'^www\.', '', domain)
+    domain = _RX_WWW.sub('', domain)
     
     return domain
 
-# Function to estimate traffic based on position
-def estimate_traffic(position, search_volume):
-    if pd.isna(position) or pd.isna(search_volume):
-        return 0
-    position = int(position)
-    search_volume = int(search_volume)
-    if position in ctr_curve:
-        return round((ctr_curve[position] / 100) * search_volume)
-    return 0
+# Vectorized equivalent of normalize_domain for a whole column
+def normalize_domain_series(s):
+    normalized = (
+        s.astype(str)
+        .str.lower()
+        .str.replace(_RX_PROTO, '', regex=True)
+        .str.split(_RX_HOST_END, n=1, regex=True).str[0]
+        .str.replace(_RX_WWW, '', regex=True)
+    )
+    return normalized.where(s != 'Unknown_Domain', s)
 
 # Function to clean and preprocess data
 def clean_data(df):
@@ -55,46 +103,81 @@ def clean_data(df):
     
     # Filter out rows with invalid rankings or search volumes
     df = df[(df['Keyword Ranking'] >= 1) & (df['Keyword Ranking'] <= 100) & (df['Search Volume'] > 0)]
+
+    # No NaNs remain in the numeric columns, so store them as plain integers
+    df = df.astype({'Keyword Ranking': 'int32', 'Search Volume': 'int64'})
     
     # Fill remaining NaNs with appropriate values
     df['Ranked Domain Name'] = df['Ranked Domain Name'].fillna('Unknown_Domain')
     df['Ranked Page URL'] = df['Ranked Page URL'].fillna('')
     
     # Normalize domain names
-    df['Ranked Domain Name'] = df['Ranked Domain Name'].apply(normalize_domain)
+    df['Ranked Domain Name'] = normalize_domain_series(df['Ranked Domain Name'])
     
     return df
 
-# Function to process the uploaded file
-def process_file(uploaded_file, designated_domains):
+# Function to read the uploaded Excel file, cached on its raw bytes
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+def _read_excel(file_bytes):
+    return pd.read_excel(
+        io.BytesIO(file_bytes),
+        engine='calamine',
+        usecols=['Keywords', 'Keyword Ranking', 'Search Volume', 'Ranked Domain Name', 'Ranked Page URL'],
+        dtype={'Keywords': 'string', 'Ranked Domain Name': 'string', 'Ranked Page URL': 'string'}
+    )
+
+# Function to process the uploaded file, cached on its raw bytes.
+# The results are shared without copying, so callers must not modify them in place.
+@st.cache_resource(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+def process_file(file_bytes):
     # Read the uploaded Excel file
-    df = pd.read_excel(uploaded_file)
+    df = _read_excel(file_bytes)
 
     # Clean and preprocess the data
     df = clean_data(df)
 
-    # Normalize designated domains
-    designated_domains = [normalize_domain(domain) for domain in designated_domains]
+    # Drop 'Keywords', which is only needed while cleaning
+    df = df.drop(columns=['Keywords'])
+
+    # Use categorical dtype so groupby works on integer codes instead of strings
+    df['Ranked Domain Name'] = df['Ranked Domain Name'].astype('category')
+    df['Ranked Page URL'] = df['Ranked Page URL'].astype('category')
 
-    # Estimate traffic for each row
-    df['Estimated Traffic'] = df.apply(
-        lambda row: estimate_traffic(row['Keyword Ranking'], row['Search Volume']), axis=1
+    # Estimate traffic for each row via the CTR lookup table
+    # (clean_data already limits rankings to 1-100, so every position is a valid index)
+    df['Estimated Traffic'] = estimate_traffic_array(
+        df['Keyword Ranking'].to_numpy(), df['Search Volume'].to_numpy()
     )
 
-    # Aggregate traffic by domain
-    domain_traffic = df.groupby('Ranked Domain Name').agg(
+    # Downcast the summed columns to the smallest integer type that fits them
+    for column in ('Search Volume', 'Estimated Traffic'):
+        df[column] = pd.to_numeric(df[column], downcast='integer')
+
+    # Aggregate traffic by domain and page URL in a single pass
+    # (pandas casts the sums back to the narrowed dtype when they fit, so widen them again
+    # to keep every output table, including the full domain list, in int64)
+    page_agg = df.groupby(['Ranked Domain Name', 'Ranked Page URL'], sort=False, observed=True, as_index=False).agg(
+        {'Search Volume': 'sum', 'Estimated Traffic': 'sum'}
+    ).astype({'Search Volume': 'int64', 'Estimated Traffic': 'int64'})
+
+    # Roll the page totals up to domain totals
+    domain_traffic = page_agg.groupby('Ranked Domain Name', observed=True, as_index=False).agg(
         {'Estimated Traffic': 'sum', 'Search Volume': 'sum'}
-    ).reset_index()
+    )
     domain_traffic.columns = ['Domain', 'Total Estimated Traffic', 'Total Search Volume']
 
+    # Return plain strings rather than categories that carry every domain in the upload
+    domain_traffic['Domain'] = domain_traffic['Domain'].astype(str)
+
     # Filter out "Unknown" domains
     domain_traffic = domain_traffic[domain_traffic['Domain'] != 'Unknown_Domain']
 
     # Sort by estimated traffic and then by search volume if estimated traffic is zero
-    domain_traffic = domain_traffic.sort_values(
-        by=['Total Estimated Traffic', 'Total Search Volume'], 
-        ascending=[False, False]
-    ).reset_index(drop=True)
+    order = np.lexsort((
+        -domain_traffic['Total Search Volume'].to_numpy(),
+        -domain_traffic['Total Estimated Traffic'].to_numpy()
+    ))
+    domain_traffic = domain_traffic.iloc[order].reset_index(drop=True)
 
     # Add ranking column for full list
     domain_traffic['Rank'] = domain_traffic.index + 1
@@ -102,28 +185,22 @@ def process_file(uploaded_file, designated_domains):
     # Select top 20 domains
     top_domains = domain_traffic.head(20)
 
-    # Filter out designated domains for separate table
-    designated_domains_traffic = domain_traffic[domain_traffic['Domain'].isin(designated_domains)]
-
     # Convert columns to appropriate types
     top_domains = top_domains.astype({'Rank': 'int', 'Total Estimated Traffic': 'int', 'Total Search Volume': 'int'})
-    if not designated_domains_traffic.empty:
-        designated_domains_traffic = designated_domains_traffic.astype({'Rank': 'int', 'Total Estimated Traffic': 'int', 'Total Search Volume': 'int'})
 
-    # Filter for top 20 domains and non-blank page URLs
-    top_pages = df[df['Ranked Domain Name'].isin(top_domains['Domain']) & (df['Ranked Page URL'] != '')]
-
-    # Group by domain and page URL, and calculate total search volume and estimated traffic
-    top_pages = top_pages.groupby(['Ranked Domain Name', 'Ranked Page URL']).agg(
-        {'Search Volume': 'sum', 'Estimated Traffic': 'sum'}
-    ).reset_index()
+    # Filter the page totals for top 20 domains and non-blank page URLs
+    top_domain_index = pd.Index(top_domains['Domain'])
+    top_pages = page_agg[
+        page_agg['Ranked Domain Name'].isin(top_domain_index) & (page_agg['Ranked Page URL'] != '')
+    ]
 
     # Sort and filter top 3 pages for each domain by Estimated Traffic
-    top_pages = top_pages.sort_values(by=['Ranked Domain Name', 'Estimated Traffic'], ascending=[True, False])
-    top_pages = top_pages.groupby('Ranked Domain Name').head(3).reset_index(drop=True)
+    top_pages = top_pages.sort_values(by=['Ranked Domain Name', 'Estimated Traffic', 'Ranked Page URL'], ascending=[True, False, True])
+    top_pages = top_pages.groupby('Ranked Domain Name', observed=True).head(3).reset_index(drop=True)
 
     # Rename columns
     top_pages.columns = ['Domain', 'Page URL', 'Total Search Volume', 'Total Estimated Traffic']
+    top_pages = top_pages.astype({'Domain': str, 'Page URL': str})
 
     # Filter out "Unknown" domains from top_pages
     top_pages = top_pages[top_pages['Domain'] != 'Unknown_Domain']
@@ -131,9 +208,62 @@ def process_file(uploaded_file, designated_domains):
     # Convert columns to appropriate types
     top_pages = top_pages.astype({'Total Search Volume': 'int', 'Total Estimated Traffic': 'int'})
 
-    return top_domains, designated_domains_traffic, top_pages, domain_traffic
+    return top_domains, top_pages, domain_traffic
 
-# Function to create a sample template
+# Function to select the designated domains from the full domain list
+def filter_designated_domains(domain_traffic, designated_domains):
+    # Normalize designated domains
+    designated_set = {normalize_domain(domain) for domain in designated_domains}
+
+    designated_domains_traffic = domain_traffic[domain_traffic['Domain'].isin(designated_set)]
+
+    # Convert columns to appropriate types
+    if not designated_domains_traffic.empty:
+        designated_domains_traffic = designated_domains_traffic.astype({'Rank': 'int', 'Total Estimated Traffic': 'int', 'Total Search Volume': 'int'})
+
+    return designated_domains_traffic
+
+# Function to write DataFrames to an in-memory Excel workbook, one sheet per entry
+def to_xlsx(sheets):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+# Function to write a DataFrame to in-memory Parquet bytes, for large tables
+def to_parquet(df):
+    output = io.BytesIO()
+    df.to_parquet(output, engine='pyarrow', compression='snappy', index=False)
+    return output.getvalue()
+
+# Function to build the Excel downloads, cached on the upload and the designated domains
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+def build_excel_downloads(file_bytes, designated_domains):
+    top_domains, top_pages, full_domain_list = process_file(file_bytes)
+    designated_domains_traffic = filter_designated_domains(full_domain_list, designated_domains)
+    return {
+        'top_domains': to_xlsx({'Top Domains': top_domains}),
+        'designated_domains_traffic': to_xlsx({'Designated Domains Traffic': designated_domains_traffic}),
+        'top_pages': to_xlsx({'Top Pages': top_pages}),
+        'all_results': to_xlsx({
+            'Top Domains': top_domains,
+            'Designated Domains Traffic': designated_domains_traffic,
+            'Top Pages': top_pages
+        })
+    }
+
+# Function to build the full domain list downloads, cached on the upload alone
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+def build_full_list_downloads(file_bytes):
+    _, _, full_domain_list = process_file(file_bytes)
+    return {
+        'parquet': to_parquet(full_domain_list),
+        'xlsx': to_xlsx({'Full Domain List': full_domain_list})
+    }
+
+# Function to create a sample template, built once and shared across sessions
+@st.cache_resource
 def create_sample_template():
     sample_data = {
         'Keywords': ['sample keyword 1', 'sample keyword 2'],
@@ -143,11 +273,7 @@ def create_sample_template():
         'Ranked Page URL': ['https://www.example.com/page1', 'https://www.example2.com/page2']
     }
     df = pd.DataFrame(sample_data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sheet1')
-    output.seek(0)
-    return output
+    return to_xlsx({'Sheet1': df})
 
 # Streamlit app
 st.title('Share of Voice Analysis Tool')
@@ -156,8 +282,7 @@ st.write('This tool allows you to upload keyword ranking data and get a share of
 
 # Provide sample template download
 st.write('### Download Sample Template')
-template = create_sample_template()
-st.download_button(label='Download Sample Template', data=template, file_name='sample_template.xlsx', mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+st.download_button(label='Download Sample Template', data=create_sample_template(), file_name='sample_template.xlsx', mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
 # File uploader
 uploaded_file = st.file_uploader("Upload your keyword data Excel file", type=["xlsx"])
@@ -169,7 +294,8 @@ designated_domains = [domain.strip() for domain in designated_domains_input.spli
 # Process the file if uploaded
 if uploaded_file:
     with st.spinner('Processing...'):
-        top_domains, designated_domains_traffic, top_pages, full_domain_list = process_file(uploaded_file, designated_domains)
+        top_domains, top_pages, full_domain_list = process_file(uploaded_file.getvalue())
+        designated_domains_traffic = filter_designated_domains(full_domain_list, designated_domains)
 
     st.success('Processing complete!')
 
@@ -188,31 +314,20 @@ if uploaded_file:
 
     # Provide download options
     st.write('### Download Results')
-    top_domains_file = io.BytesIO()
-    designated_domains_traffic_file = io.BytesIO()
-    top_pages_file = io.BytesIO()
-    full_domain_list_file = io.BytesIO()
-
-    with pd.ExcelWriter(top_domains_file, engine='xlsxwriter') as writer:
-        top_domains.to_excel(writer, index=False, sheet_name='Top Domains')
-    with pd.ExcelWriter(designated_domains_traffic_file, engine='xlsxwriter') as writer:
-        designated_domains_traffic.to_excel(writer, index=False, sheet_name='Designated Domains Traffic')
-    with pd.ExcelWriter(top_pages_file, engine='xlsxwriter') as writer:
-        top_pages.to_excel(writer, index=False, sheet_name='Top Pages')
-    with pd.ExcelWriter(full_domain_list_file, engine='xlsxwriter') as writer:
-        if 'Sort Order' in full_domain_list.columns:
-            full_domain_list = full_domain_list.drop(columns=['Sort Order'])  # Drop 'Sort Order' column if it exists
-        full_domain_list.to_excel(writer, index=False, sheet_name='Full Domain List')
-
-    top_domains_file.seek(0)
-    designated_domains_traffic_file.seek(0)
-    top_pages_file.seek(0)
-    full_domain_list_file.seek(0)
-
-    st.download_button(label='Download Top Domains', data=top_domains_file, file_name='top_domains.xlsx')
-    st.download_button(label='Download Designated Domains Traffic', data=designated_domains_traffic_file, file_name='designated_domains_traffic.xlsx')
-    st.download_button(label='Download Top Pages', data=top_pages_file, file_name='top_pages.xlsx')
-    st.download_button(label='Download Full Domain List', data=full_domain_list_file, file_name='full_domain_list.xlsx')
+    excel_downloads = build_excel_downloads(uploaded_file.getvalue(), tuple(designated_domains))
+    full_list_downloads = build_full_list_downloads(uploaded_file.getvalue())
+
+    st.download_button(label='Download Top Domains', data=excel_downloads['top_domains'], file_name='top_domains.xlsx')
+    st.download_button(label='Download Designated Domains Traffic', data=excel_downloads['designated_domains_traffic'], file_name='designated_domains_traffic.xlsx')
+    st.download_button(label='Download Top Pages', data=excel_downloads['top_pages'], file_name='top_pages.xlsx')
+    st.download_button(label='Download Full Domain List (Parquet)', data=full_list_downloads['parquet'], file_name='full_domain_list.parquet', mime='application/octet-stream')
+    st.download_button(label='Download Full Domain List (Excel)', data=full_list_downloads['xlsx'], file_name='full_domain_list.xlsx')
+    st.download_button(
+        label='Download All Results',
+        data=excel_downloads['all_results'],
+        file_name='share_of_voice_results.xlsx',
+        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
 
 # Instructions
 st.write('''
@@ -226,5 +341,5 @@ st.write('''
    - Ranked Page URL (https://www.domain.com/page-url, subdomain.domain.com/page-url, etc...)
 3. Enter any designated domains you want to be returned, separated by commas.
 4. The tool will process the data and display the top 20 domains by estimated traffic, traffic for designated domains, and top 3 pages for the top 20 domains.
-5. You can download the results as Excel files.
+5. You can download the results as Excel files, individually or as a single workbook with one sheet per table. The full domain list is available as a Parquet file (smaller and faster for large lists) or as an Excel file.
 ''')